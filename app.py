@@ -1,56 +1,248 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, make_response
+from flask.json.provider import JSONProvider
 import logging
 import os
+import functools
+import hashlib
 import json
+import math
+import string
+import time
+import orjson
 import requests
-from typing import Dict, Any, Optional, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from threading import BoundedSemaphore, Lock, Thread
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from cachetools import TTLCache
+from typing import Callable, Dict, Any, Optional, List
+
+# --- Configuration du Logging ---
+# Avant tout le reste : un appel à logging.info() antérieur installerait la config par défaut (niveau WARNING)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # --- Initialisation de Flask ---
+class OrjsonProvider(JSONProvider):
+    # jsonify() et request.json passent par orjson plutôt que par le module json standard
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # --- Configuration ---
 app.config['BIRDEYE_API_KEY'] = os.environ.get('BIRDEYE_API_KEY')
 app.config['GEMINI_API_KEY'] = os.environ.get('GEMINI_API_KEY')
+app.config['GEMINI_MAX_CONCURRENCY'] = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))
+
+# --- Session HTTP partagée (Keep-Alive + pool de connexions) ---
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10, pool_maxsize=20,
+    # read=False : un timeout de lecture n'est pas retenté (3 x 10 s sinon) et remonte tel quel en ReadTimeout.
+    # Seules les 5xx sont retentées : renvoyer aussitôt une requête refusée en 429 consommerait du quota pour un nouveau 429,
+    # et un Retry-After (sans borne) ne doit pas endormir le worker.
+    max_retries=Retry(total=2, read=False, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504],
+                      allowed_methods=["GET"], respect_retry_after_header=False),
+))
+# Toutes les API appelées répondent en JSON ; "br" est ajouté à Accept-Encoding par urllib3 dès que brotli est installé
+SESSION.headers["Accept"] = "application/json"
+HTTP_TIMEOUT = (3, 10)  # (connexion, lecture) en secondes : un upstream bloqué ne doit pas figer un worker
+
+# --- Cache mémoire (données de marché identiques pour tous les visiteurs) ---
+_CACHE_LOCK = Lock()
+_MARKET_CACHE = TTLCache(maxsize=16, ttl=60)
+# Dernière valeur valide (horodatée), servie pendant qu'un thread la rafraîchit après expiration du TTL
+_LAST_GOOD: Dict[str, tuple[float, Any]] = {}
+_REFRESHING: set = set()
+_STALE_MAX_AGE = 600  # au-delà, on refait un appel synchrone plutôt que d'afficher des données trop vieilles
+# Verdicts Gemini indexés par empreinte du prompt : mêmes données de token => même analyse, sans repayer l'appel
+_GEMINI_CACHE = TTLCache(maxsize=512, ttl=600)
+# Appels en cours par clé : les requêtes identiques simultanées attendent le résultat du premier appel
+_INFLIGHT: Dict[Any, Future] = {}
+
+def _single_flight(key: Any, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+    with _CACHE_LOCK:
+        future = _INFLIGHT.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = _INFLIGHT[key] = Future()
+    if not is_leader:
+        # timeout : un leader bloqué ne doit pas entraîner tous les visiteurs qui l'attendent (FutureTimeoutError)
+        return future.result(timeout=timeout)
+    try:
+        result = fn()
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _CACHE_LOCK:
+            _INFLIGHT.pop(key, None)
 
 # --- Initialisation de l'API Gemini ---
-model = None
-if app.config['GEMINI_API_KEY']:
+# Import et configuration au premier usage : le SDK est lourd et inutile pour les pages sans IA
+@functools.lru_cache(maxsize=1)
+def _get_model():
+    if not app.config['GEMINI_API_KEY']:
+        return None
     try:
         import google.generativeai as genai
         genai.configure(api_key=app.config['GEMINI_API_KEY'])
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        logging.info("INFO: API Gemini configurée avec succès")
+        model = genai.GenerativeModel('gemini-1.5-flash', generation_config=_GEMINI_GENERATION_CONFIG)
+        logger.info("INFO: API Gemini configurée avec succès")
+        return model
     except Exception as e:
-        logging.error(f"ERREUR: La configuration de l'API Gemini a échoué - {e}")
+        logger.error("ERREUR: La configuration de l'API Gemini a échoué - %s", e)
+        return None
 
-# --- Configuration du Logging ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Au plus N appels Gemini simultanés par worker : au-delà, les requêtes attendent une place
+# plutôt que de déclencher des 429 en rafale
+_GEMINI_SLOTS = BoundedSemaphore(app.config['GEMINI_MAX_CONCURRENCY'])
+_GEMINI_SLOT_TIMEOUT = 15  # secondes
+_GEMINI_CALL_TIMEOUT = 20  # secondes : un appel bloqué ne doit pas garder sa place indéfiniment
+
+# --- Nettoyage des réponses Gemini ---
+# Décodeur de secours : lit le premier objet JSON à partir d'une position donnée et ignore la suite
+_JSON_DECODER = json.JSONDecoder()
+
+def _parse_gemini_json(text: str) -> Any:
+    # Cas nominal en mode JSON : la réponse est l'objet lui-même
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    # Sinon (balises ```json, texte avant ou après) : décodage à partir de la première accolade
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("Aucun objet JSON dans la réponse de l'IA")
+    return _JSON_DECODER.raw_decode(text, start)[0]
+
+# Champs envoyés par analyzer.html (fetchGeminiAnalysis)
+_PROMPT_FIELDS = ("nom", "symbole", "prix_usd", "variation_24h_pourcent", "volume_24h_usd",
+                  "liquidite_usd", "market_cap", "transactions_24h")
+
+# Prompt construit une fois au chargement ; seules les données du token changent d'un appel à l'autre.
+# Le format JSON et les valeurs possibles du verdict sont imposés par _GEMINI_GENERATION_CONFIG, pas répétés ici.
+_GEMINI_PROMPT = string.Template("""En analyste crypto expert et concis, évalue ce token Solana (données DexScreener) : $token_data
+verdict : recommandation d'investissement. risk_score : de 1 (très faible) à 10 (très élevé).
+positive_points / negative_points : 2 à 3 points clés chacun, en français. summary : une phrase justifiant la recommandation.""")
+
+# Mode JSON natif de Gemini : la sortie respecte ce schéma, sans balises ``` ni texte autour
+_GEMINI_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "verdict": {"type": "string", "format": "enum", "enum": ["STRONG BUY", "BUY", "HOLD", "SELL", "HIGH-RISK"]},
+            "risk_score": {"type": "integer"},
+            "positive_points": {"type": "array", "items": {"type": "string"}},
+            "negative_points": {"type": "array", "items": {"type": "string"}},
+            "summary": {"type": "string"},
+        },
+        "required": ["verdict", "risk_score", "positive_points", "negative_points", "summary"],
+    },
+    "temperature": 0.2,
+    "max_output_tokens": 512,
+}
+
+# Verdict renvoyé sans appel à Gemini quand le token n'a eu aucune activité sur 24h
+_NO_ACTIVITY_ANALYSIS = {
+    "verdict": "HIGH-RISK",
+    "risk_score": 10,
+    "positive_points": [],
+    "negative_points": ["Aucun volume ni aucune transaction sur les dernières 24h.",
+                        "Impossible de sortir d'une position sans acheteurs ni vendeurs."],
+    "summary": "Token inactif depuis 24h : aucune donnée de marché ne justifie une prise de position.",
+}
+# Idem quand la pool a été vidée (liquidité explicitement à 0, typique d'un rug pull)
+_NO_LIQUIDITY_ANALYSIS = {
+    "verdict": "HIGH-RISK",
+    "risk_score": 10,
+    "positive_points": [],
+    "negative_points": ["Liquidité nulle : la pool a été vidée ou n'a jamais été alimentée.",
+                        "Aucune vente possible sans contrepartie, position impossible à clôturer."],
+    "summary": "Sans liquidité, le token ne peut pas être revendu : risque maximal, analyse IA inutile.",
+}
 
 # --- Filtres Jinja2 ---
+# (seuil, suffixe) parcourus une seule fois, du plus grand au plus petit
+_NUMBER_SCALES = ((1_000_000_000, "B"), (1_000_000, "M"), (1_000, "K"))
+
+@functools.lru_cache(maxsize=4096)
+def _format_number_cached(value: float) -> str:
+    for threshold, suffix in _NUMBER_SCALES:
+        if value >= threshold: return f"{value/threshold:.2f}{suffix}"
+    return f"{value:,.2f}"
+
 @app.template_filter()
 def format_number(value):
-    try:
-        value = float(value)
-        if value >= 1_000_000_000: return f"{value/1_000_000_000:.2f}B"
-        if value >= 1_000_000: return f"{value/1_000_000:.2f}M"
-        if value >= 1_000: return f"{value/1_000:.2f}K"
-        return f"{value:,.2f}"
+    # Les mêmes valeurs reviennent d'un rendu à l'autre (cache des tendances) : on mémoïse le formatage
+    try: value = float(value)
     except (ValueError, TypeError): return "N/A"
+    # NaN/inf : s'afficheraient "nan"/"infB", et NaN (égal à rien) raterait le cache à chaque appel
+    if not math.isfinite(value): return "N/A"
+    return _format_number_cached(value)
 
 # --- Services (uniquement pour les tendances) ---
 class BirdeyeService:
+    # Construit une seule fois ; passé par appel plutôt que sur la Session pour ne pas envoyer la clé à d'autres hôtes
+    HEADERS = {"X-API-KEY": app.config['BIRDEYE_API_KEY'], "x-chain": "solana"}
+
     @staticmethod
     def get_trending_tokens() -> tuple[List[Dict[str, Any]], Optional[str]]:
+        with _CACHE_LOCK:
+            tokens = _MARKET_CACHE.get("trending")
+            saved_at, stale = _LAST_GOOD.get("trending", (0.0, None))
+            if time.monotonic() - saved_at > _STALE_MAX_AGE:
+                stale = None
+            start_refresh = tokens is None and stale is not None and "trending" not in _REFRESHING
+            if start_refresh:
+                _REFRESHING.add("trending")
+        if tokens is not None:
+            return tokens, None
+        if stale is not None:
+            # TTL expiré : on sert l'ancienne liste tout de suite, un seul thread va chercher la nouvelle
+            if start_refresh:
+                Thread(target=BirdeyeService._refresh_trending_tokens, daemon=True).start()
+            return stale, None
+        return _single_flight("trending", BirdeyeService._refresh_trending_tokens)
+
+    @staticmethod
+    def _refresh_trending_tokens() -> tuple[List[Dict[str, Any]], Optional[str]]:
+        try:
+            tokens, error = BirdeyeService._fetch_trending_tokens()
+            with _CACHE_LOCK:
+                # On ne met en cache que les réponses valides, les erreurs sont retentées au prochain appel
+                if error is None:
+                    _MARKET_CACHE["trending"] = tokens
+                    _LAST_GOOD["trending"] = (time.monotonic(), tokens)
+            return tokens, error
+        finally:
+            # Même sur exception imprévue, sinon plus aucun rafraîchissement en fond jusqu'à _STALE_MAX_AGE
+            with _CACHE_LOCK:
+                _REFRESHING.discard("trending")
+
+    @staticmethod
+    def _fetch_trending_tokens() -> tuple[List[Dict[str, Any]], Optional[str]]:
         url = f"https://public-api.birdeye.so/defi/tokenlist?sort_by=v24hUSD&sort_type=desc&limit=50"
-        headers = {"X-API-KEY": app.config['BIRDEYE_API_KEY']}
         try:
-            response = requests.get(url, headers=headers)
+            response = SESSION.get(url, headers=BirdeyeService.HEADERS, timeout=HTTP_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             return (data.get('data', {}).get('tokens', []), None) if data.get('success') else ([], "Réponse invalide")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Erreur API Birdeye (get_trending_tokens): {e}")
-            return [], str(e)
+        except requests.exceptions.Timeout as e:
+            logger.error("Timeout API Birdeye (get_trending_tokens): %s", e)
+            return [], "Birdeye ne répond pas, réessayez dans quelques instants."
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            # Le détail (URL, pool urllib3...) va dans les logs, pas dans la page
+            logger.error("Erreur API Birdeye (get_trending_tokens): %s", e)
+            return [], "Impossible de récupérer les tendances Birdeye, réessayez dans quelques instants."
 
 # --- Routes Flask ---
 @app.route("/")
@@ -62,47 +254,96 @@ def analyzer():
     # Sert simplement la page HTML. Toute la logique est maintenant côté client.
     return render_template("analyzer.html")
 
+# Version du rendu, mêlée à l'ETag : un déploiement qui modifie le template ou app.py (format_number)
+# invalide les pages gardées par les navigateurs, même si les données n'ont pas changé
+with open(__file__, "rb") as _source:
+    _TENDANCES_VERSION = hashlib.blake2b(
+        app.jinja_env.loader.get_source(app.jinja_env, "tendances.html")[0].encode() + _source.read(), digest_size=8
+    ).digest()
+
 @app.route("/tendances")
 def tendances():
     trending_data, error = BirdeyeService.get_trending_tokens()
-    return render_template("tendances.html", trending_data=trending_data, error=error)
+    # ETag dérivé des données : tant que la liste n'a pas changé, le navigateur reçoit un 304 sans rendu du template
+    etag = hashlib.blake2b(_TENDANCES_VERSION + orjson.dumps([trending_data, error]), digest_size=16).hexdigest()
+    # Comparaison faible (RFC 7232) : un proxy qui réécrit le tag en W/"..." ne doit pas casser le 304
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render_template("tendances.html", trending_data=trending_data, error=error))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # toujours revalider : les tendances changent toutes les minutes
+    return response
 
 # --- NOUVELLE ROUTE API ---
+class GeminiBusyError(Exception):
+    """Aucune place libre pour un appel Gemini dans le délai imparti."""
+
+def _ask_gemini(model, prompt: str, cache_key: bytes) -> Dict[str, Any]:
+    if not _GEMINI_SLOTS.acquire(timeout=_GEMINI_SLOT_TIMEOUT):
+        raise GeminiBusyError()
+    try:
+        response = model.generate_content(prompt, request_options={"timeout": _GEMINI_CALL_TIMEOUT})
+    finally:
+        _GEMINI_SLOTS.release()
+    ai_analysis = _parse_gemini_json(response.text)
+    with _CACHE_LOCK:
+        _GEMINI_CACHE[cache_key] = ai_analysis
+    return ai_analysis
+
 @app.route("/api/gemini-analysis", methods=["POST"])
 def gemini_analysis_proxy():
+    model = _get_model()
     if not model:
         return jsonify({"error": "Le service IA n'est pas configuré sur le serveur."}), 500
 
     token_data = request.json
-    if not token_data:
+    if not token_data or not isinstance(token_data, dict):
+        return jsonify({"error": "Aucune donnée de token fournie."}), 400
+    # Seuls les champs connus et renseignés partent dans le prompt (moins de tokens facturés)
+    prompt_data = {k: token_data[k] for k in _PROMPT_FIELDS if token_data.get(k) is not None}
+    if not prompt_data:
         return jsonify({"error": "Aucune donnée de token fournie."}), 400
 
+    # Raccourci : volume et transactions explicitement à 0, le verdict est connu d'avance, inutile de payer un appel IA.
+    # Un champ absent n'est pas un 0 : il est simplement omis du prompt.
+    if prompt_data.get("volume_24h_usd") == 0 and prompt_data.get("transactions_24h") == 0:
+        return jsonify(_NO_ACTIVITY_ANALYSIS)
+    # DexScreener omet la liquidité sur certaines pools (bonding curves) : seul un 0 explicite est disqualifiant
+    if prompt_data.get("liquidite_usd") == 0:
+        return jsonify(_NO_LIQUIDITY_ANALYSIS)
+
     # Préparation du prompt pour Gemini
-    prompt = f"""
-    Analyse ce token Solana avec les données de DexScreener : {json.dumps(token_data)}.
-    Agis comme un analyste crypto expert et concis.
-    Fournis une analyse structurée.
-    1. "verdict": Un verdict d'investissement unique et direct parmi : "STRONG BUY", "BUY", "HOLD", "SELL", "HIGH-RISK".
-    2. "risk_score": Un score de risque de 1 (très faible) à 10 (très élevé).
-    3. "positive_points": Une liste de 2 à 3 points positifs clés (en français).
-    4. "negative_points": Une liste de 2 à 3 points négatifs ou risques (en français).
-    5. "summary": Un résumé final d'une phrase expliquant ta recommandation.
-    Retourne ta réponse UNIQUEMENT en format JSON valide.
-    """
+    prompt = _GEMINI_PROMPT.substitute(token_data=orjson.dumps(prompt_data).decode())
+    cache_key = hashlib.sha1(prompt.encode()).digest()
+    with _CACHE_LOCK:
+        ai_analysis = _GEMINI_CACHE.get(cache_key)
+    if ai_analysis is not None:
+        return jsonify(ai_analysis)
+
     try:
-        response = model.generate_content(prompt)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        ai_analysis = json.loads(cleaned_response)
+        # Deux visiteurs sur le même token au même moment partagent un seul appel Gemini
+        ai_analysis = _single_flight(cache_key, lambda: _ask_gemini(model, prompt, cache_key),
+                                     timeout=_GEMINI_SLOT_TIMEOUT + _GEMINI_CALL_TIMEOUT)
         return jsonify(ai_analysis)
+    except (GeminiBusyError, FutureTimeoutError):
+        return jsonify({"error": "Le service IA est saturé, réessayez dans quelques instants."}), 503
     except Exception as e:
-        logging.error(f"Erreur analyse Gemini: {e}")
+        logger.exception("Erreur analyse Gemini: %s", e)
         return jsonify({"error": "L'analyse par l'IA a échoué.", "summary": str(e)}), 500
 
 # --- Gestionnaires d'Erreurs ---
 @app.errorhandler(404)
 def not_found(e): return render_template("404.html"), 404
 @app.errorhandler(500)
-def server_error(e): logging.error(f"Erreur Serveur 500: {e}"); return render_template("500.html"), 500
+def server_error(e): logger.error("Erreur Serveur 500: %s", e); return render_template("500.html"), 500
+
+# --- Templates précompilés (production) ---
+# Hors debug : compilation faite au chargement (preload_app, donc une seule fois dans le master) plutôt qu'à la 1re requête
+if not app.debug:
+    for _name in ("index.html", "analyzer.html", "tendances.html", "404.html", "500.html"):
+        app.jinja_env.get_template(_name)
 
+# Serveur de développement local uniquement ; en production : gunicorn (cf. Procfile et gunicorn.conf.py)
 if __name__ == "__main__":
     app.run(debug=True)
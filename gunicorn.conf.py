@@ -0,0 +1,35 @@
+# --- Configuration Gunicorn (chargée automatiquement par `gunicorn app:app`, cf. Procfile) ---
+import os
+
+# L'application est importée une seule fois dans le master puis partagée par fork (copy-on-write) :
+# Session HTTP et caches sont construits avant le fork. Le SDK Gemini est importé dans le master
+# (when_ready), mais le client reste créé dans chaque worker (_get_model) car gRPC ne survit pas à un fork.
+preload_app = True
+
+# Les requêtes passent l'essentiel de leur temps à attendre Birdeye / Gemini :
+# des threads permettent à un même worker de servir plusieurs visiteurs en parallèle.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+keepalive = 30
+
+
+def when_ready(server):
+    # Import du SDK Gemini (~0,5 s, ~80 Mo) une seule fois, avant le fork : les workers le partagent
+    # en copy-on-write au lieu de le réimporter chacun. Aucun canal gRPC n'est ouvert à l'import.
+    if os.environ.get("GEMINI_API_KEY"):
+        try:
+            import google.generativeai  # noqa: F401
+        except ImportError as e:
+            server.log.warning("SDK Gemini indisponible : %s", e)
+
+
+def post_worker_init(worker):
+    # Préchauffage après le fork, dans chaque worker : le premier visiteur ne paie ni la configuration du modèle
+    # Gemini (le SDK est déjà importé par le master), ni la poignée de main TLS vers Birdeye. Le chargement des
+    # tendances part en tâche de fond pour ne pas retarder la prise de requêtes si Birdeye est lent.
+    from threading import Thread
+    from app import BirdeyeService, _get_model
+
+    _get_model()
+    Thread(target=BirdeyeService.get_trending_tokens, daemon=True).start()